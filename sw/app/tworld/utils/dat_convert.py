@@ -800,7 +800,7 @@ class Config:
 
 def create_config(args: argparse.Namespace) -> Config:
     input_file = Path(args.input_file)
-    if not input_file.exists() or not input_file.is_file():
+    if not input_file.is_file():
         raise EncodeError(f"invalid input file '{args.input_file}'")
 
     output_file = Path(args.output_file)
@@ -865,6 +865,10 @@ class LevelPackObject(DataObject):
         except EncodeError as e:
             raise PackError(f"encoding error: {e}")
 
+    def can_pack_concurrently(self) -> bool:
+        # level conversion prints warnings and a summary for each level.
+        return False
+
     def get_type_name(self) -> str:
         return "level pack"
 
@@ -46,6 +46,11 @@ PACKED_ASSETS_FILE = assets_packer.ASSETS_FILE
 # output filename for this script
 PACKED_APP_FILE = "target.app"
 
+# patterns used to parse configuration files and validate their fields
+CONFIG_LINE_PATTERN = re.compile(r"^\s*(\w+)\s*=\s*(.*?)\s*(?:#.*)?$")
+TITLE_PATTERN = re.compile(r"^[A-Za-z\d\-_ .]{1,15}$")
+AUTHOR_PATTERN = re.compile(r"^[A-Z\d\-_ .]{1,15}$")
+
 
 class PackError(Exception):
     pass
@@ -66,7 +71,7 @@ def read_config_file(filename: PathLike) -> Dict[str, str]:
     config = {}
     with open(filename, "r") as file:
         for line in file:
-            match = re.match(r"^\s*(\w+)\s*=\s*(.*?)\s*(?:#.*)?$", line)
+            match = CONFIG_LINE_PATTERN.match(line)
             if match:
                 config[match.group(1)] = match.group(2)
     return config
@@ -93,9 +98,9 @@ def read_target_config(target_path: Path) -> TargetConfig:
         raise PackError("app ID must be between 0x01 and 0xff")
     if not (0x0000 <= version <= 0xffff):
         raise PackError("version must be between 0 and 0xffff")
-    if not re.match(r"^[A-Za-z\d\-_ .]{1,15}$", title):
+    if not TITLE_PATTERN.match(title):
         raise PackError("title has an invalid format")
-    if not re.match(r"^[A-Z\d\-_ .]{1,15}$", author):
+    if not AUTHOR_PATTERN.match(author):
         raise PackError("author has an invalid format")
     if not (0 <= eeprom_space <= 0xffff):
         raise PackError(f"EEPROM space out of bounds")
@@ -12,20 +12,26 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from typing import Optional, Iterable, TextIO, Union
+import binascii
+import io
+from typing import Optional, Iterable, TextIO, Union, Sequence
 
 from assets.types import Location
-from utils import PathLike
+from utils import PathLike, pack_uints
 
 
 class CodeWriter:
-    """Lower level C code writer."""
+    """Lower level C code writer. Code is buffered in memory and written to file on close."""
+    filename: PathLike
     file: TextIO
 
     def __init__(self, filename: PathLike):
-        self.file = open(filename, "w")
+        self.filename = filename
+        self.file = io.StringIO()
 
     def close(self) -> None:
+        with open(self.filename, "w") as file:
+            file.write(self.file.getvalue())
         self.file.close()
 
     def directive(self, name: str, value: Optional[str] = None) -> None:
@@ -45,18 +51,20 @@ class CodeWriter:
             self.file.write("const ")
         self.file.write(f"{data_type} {name}[]")
 
-    def array(self, name: str, data_type: str, data: Optional[Iterable[int]] = None, *,
-              constant: bool = False, extern: bool = False) -> None:
+    def array(self, name: str, data_type: str, data: Optional[Sequence[int]] = None, *,
+              value_bytes: int = 1, constant: bool = False, extern: bool = False) -> None:
         self._array(name, data_type, constant, extern)
         if data is None:
             self.file.write(";\n")
         else:
             self.file.write(" = {")
-            max_value_size = len(f"{max(data):x}")
-            for i, value in enumerate(data):
-                if i % 8 == 0:
-                    self.file.write("\n        ")
-                self.file.write(f"0x{f'{value:x}'.rjust(max_value_size, '0')}, ")
+            # convert all values to hex at once from their big endian representation,
+            # all values have the width of the array type.
+            hex_str = binascii.hexlify(pack_uints(data, value_bytes, "big")).decode()
+            step = value_bytes * 2
+            values = [f"0x{hex_str[i:i + step]}, " for i in range(0, len(hex_str), step)]
+            self.file.write("".join(f"\n        {''.join(values[i:i + 8])}"
+                                    for i in range(0, len(values), 8)))
             self.file.write("\n};\n\n")
 
     def ptr_array(self, name: str, data_type: str, data: Optional[Iterable[str]] = None, *,
@@ -66,13 +74,11 @@ class CodeWriter:
             self.file.write(";\n")
         else:
             self.file.write(" = {")
-            for value in data:
-                self.file.write(f"\n        {value},")
+            self.file.write("".join(f"\n        {value}," for value in data))
             self.file.write("\n};\n\n")
 
     def space(self, n: int = 1) -> None:
-        for i in range(n):
-            self.file.write("\n")
+        self.file.write("\n" * n)
 
 
 class CodeGenerator:
@@ -119,7 +125,7 @@ class CodeGenerator:
                    location: Optional[Location] = None) -> None:
         if isinstance(value, int):
             if is_hex:
-                value_str = f"0x{f'{value:x}'.rjust(CodeGenerator.ADDRESS_WIDTH, '0')}"
+                value_str = f"0x{value:0{CodeGenerator.ADDRESS_WIDTH}x}"
             else:
                 value_str = str(value)
             if value > CodeGenerator.INT_MAX:
@@ -138,11 +144,11 @@ class CodeGenerator:
             value = f"({value})"
         self.header.directive("define", f"{name}({', '.join(args)}) {value}")
 
-    def add_array(self, name: str, type_width: int, data: Iterable[int]) -> None:
+    def add_array(self, name: str, type_width: int, data: Sequence[int]) -> None:
         name = name.upper()
         data_type = f"uint{type_width * 8}_t"
         self.header.array(name, data_type, constant=True, extern=True)
-        self.source.array(name, data_type, data, constant=True)
+        self.source.array(name, data_type, data, value_bytes=type_width, constant=True)
         self.source_written = True
 
     def add_ptr_array(self, name: str, type_width: int, data: Iterable[str]) -> None:
@@ -25,11 +25,10 @@
 # char separated by one pixel of whitespace.
 
 import argparse
-import math
 import sys
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 from PIL import Image
 
@@ -112,7 +111,7 @@ class FontData:
         if self.max_offset not in FontData.MAX_OFFSET_RANGE:
             raise EncodeError(f"Y offset of {self.max_offset} px is out of bounds, "
                               f"valid range is {range_repr(FontData.MAX_OFFSET_RANGE)}")
-        self.offset_bits = 0 if self.max_offset == 0 else int(math.log2(self.max_offset) + 1)
+        self.offset_bits = self.max_offset.bit_length()
 
         glyph_bit_length = self.width * self.height + self.offset_bits
         self.bytes_per_glyph = ((glyph_bit_length - 1) // 8) + 1
@@ -183,6 +182,9 @@ class FontObject(DataObject):
     def is_in_unified_data_space(self) -> bool:
         return True
 
+    def get_source_file(self) -> Optional[Path]:
+        return self.file
+
     def get_type_name(self) -> str:
         return "font"
 
@@ -197,7 +199,7 @@ def register_builder(packer) -> None:
 
 def create_config(args: argparse.Namespace) -> Config:
     input_file = Path(args.input_file)
-    if not input_file.exists() or not input_file.is_file():
+    if not input_file.is_file():
         raise EncodeError("invalid input file")
 
     line_spacing: int = args.line_spacing + args.glyph_height
@@ -21,14 +21,14 @@
 #
 import abc
 import argparse
-import math
+import itertools
 import sys
 from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
-from typing import List, Optional, Generator, Callable, Tuple
+from typing import List, Optional, Tuple
 
-from PIL import Image
+from PIL import Image, ImageChops
 
 sys.path.append(str(Path(__file__).absolute().parent.parent))  # for standalone run
 from assets.types import PackResult, DataObject, PackError
@@ -89,28 +89,32 @@ class Rect:
 TRANSPARENT_COLOR = 0xff
 
 
-def pixel_iterator(image: Image, levels: int, rect: Optional[Rect] = None,
-                   row_cb: Optional[Callable[[int], None]] = None) -> Generator[int, None, None]:
-    if not rect:
-        rect = Rect(0, 0, image.width - 1, image.height - 1)
-    for y in range(rect.top, rect.bottom + 1):
-        if row_cb:
-            row_cb(y)
-        for x in range(rect.left, rect.right + 1):
-            color, alpha = image.getpixel((x, y))
-            if alpha < 128:
-                yield TRANSPARENT_COLOR
-            else:
-                yield math.floor((color / 256) * levels)
+def read_region(image: Image, levels: int, rect: Rect) -> bytes:
+    """Read the colors of the pixels in a region of a grayscale + alpha image, quantized to a
+    number of gray levels, row by row. Transparent pixels have the TRANSPARENT_COLOR value."""
+    lum, alpha = image.crop((rect.left, rect.top, rect.right + 1, rect.bottom + 1)).split()
+    colors = lum.point([(p * levels) >> 8 for p in range(256)])
+    mask = alpha.point([TRANSPARENT_COLOR if a < 128 else 0 for a in range(256)])
+    # mask is either 0 or has all bits set and colors are smaller, so the lighter of the two
+    # is TRANSPARENT_COLOR for transparent pixels and the color for other pixels.
+    return ImageChops.lighter(colors, mask).tobytes()
 
 
 @dataclass
 class ImageIndex:
     granularity: int
     entries: List[int] = field(default_factory=list)
+    # largest entry added to the index, used during granularity search only.
+    # not part of the index data (entries[0] is replaced by the entry count when encoding).
+    max_entry: int = field(default=0, repr=False, compare=False)
 
     MAX_ENTRY = 256
 
+    def add_entry(self, entry: int) -> None:
+        self.entries.append(entry)
+        if entry > self.max_entry:
+            self.max_entry = entry
+
     def encode(self) -> bytes:
         data = bytearray([self.granularity])
         for entry in self.entries:
@@ -171,6 +175,11 @@ class ImageEncoder(abc.ABC):
     _run_length: int
     _last_color: int
     _last_data_len: int
+    # colors of the pixels in region, by row
+    _pixels: List[bytes]
+    # dimensions of the region being encoded
+    _width: int
+    _height: int
 
     MAX_IMAGE_WIDTH = 128
     MAX_IMAGE_HEIGHT = 256
@@ -189,6 +198,9 @@ class ImageEncoder(abc.ABC):
         self.indexed = True
         self.index_granularity = ImageEncoder.DEFAULT_INDEX_GRANULARITY
         self.alpha_color = ImageEncoder.ALPHA_COLOR_NONE
+        self._pixels = []
+        self._width = 0
+        self._height = 0
         self._reset()
 
     def _reset(self) -> None:
@@ -199,46 +211,83 @@ class ImageEncoder(abc.ABC):
         self._run_length = 0
         self._last_color = ImageEncoder._LAST_COLOR_NONE
 
+    def _read_pixels(self) -> List[bytes]:
+        """Read the colors of the pixels in the encoded region, row by row.
+        Transparent pixels are replaced by the alpha color."""
+        pixels = read_region(self.image, self.get_gray_levels(), self.region)
+        if self.alpha_color == ImageEncoder.ALPHA_COLOR_NONE:
+            alpha_color = 0
+        else:
+            alpha_color = self.alpha_color
+            if TRANSPARENT_COLOR in pixels:
+                self._flags |= ImageData.FLAG_ALPHA
+        pixels = pixels.translate(bytes(range(TRANSPARENT_COLOR)) + bytes((alpha_color,)))
+        width = self._width
+        return [pixels[i:i + width] for i in range(0, len(pixels), width)]
+
     def _iterate_pixels(self) -> None:
-        def row_cb(y: int) -> None:
+        for y, row in enumerate(self._pixels, self.region.top):
             if y % self.index.granularity == 0 and self._indexed:
                 self._end_run_length(0, True)
-                self.index.entries.append(len(self._data) - self._last_data_len)
+                self.index.add_entry(len(self._data) - self._last_data_len)
                 self._last_data_len = len(self._data)
 
-        for color in pixel_iterator(self.image, self.get_gray_levels(), self.region, row_cb):
-            if color == TRANSPARENT_COLOR:
-                if self.alpha_color == ImageEncoder.ALPHA_COLOR_NONE:
-                    color = 0
-                else:
-                    self._flags |= ImageData.FLAG_ALPHA
-                    color = self.alpha_color
+            for color, run in itertools.groupby(row):
+                self._append_run(color, sum(1 for _ in run))
 
-            if (self._last_color == ImageEncoder._LAST_COLOR_NONE or color == self._last_color) \
-                    and self._run_length < self._get_max_run_length():
-                self._run_length += 1
-            else:
+        self._end_run_length(0, True)
+
+    def _append_run(self, color: int, length: int) -> None:
+        """Append `length` pixels of the same color. The current run length is extended
+        by as many pixels as possible at once, and ended each time it reaches the maximum."""
+        if color != self._last_color:
+            if self._last_color != ImageEncoder._LAST_COLOR_NONE:
                 self._end_run_length(color, False)
+                length -= 1
             self._last_color = color
 
-        self._end_run_length(0, True)
+        max_run_length = self._get_max_run_length()
+        while length > 0:
+            n = min(length, max_run_length - self._run_length)
+            self._run_length += n
+            length -= n
+            if length > 0:
+                # maximum run length reached (or no run length support), end run.
+                self._end_run_length(color, False)
+                length -= 1
+                max_run_length = self._get_max_run_length()
 
     def encode(self) -> ImageData:
         self._reset()
+        self._width = self.region.width()
+        self._height = self.region.height()
+        # pixels are only read once, then shared by all encoding passes.
+        self._pixels = self._read_pixels()
+        if not self._indexed:
+            # index disabled, encode once without searching for granularity.
+            self._encode_with_granularity(self._height)
+            self.index = None
+            return ImageData(self._flags, self.alpha_color,
+                             self._width, self._height, None, self._data)
+
         granularity = 0
+        # last result of the granularity search (data and index).
+        probe: Optional[Tuple[bytearray, ImageIndex]] = None
         if self._flags & ImageData.FLAG_RAW:
             # implicitly indexed raw image, reset state at the end of each row
             granularity = 1
-        elif self._indexed and self.index_granularity.mode == IndexGranularityMode.MAX_SIZE:
+        elif self.index_granularity.mode == IndexGranularityMode.MAX_SIZE:
             # increase row granularity until size spec is exceeded
             while True:
                 self._encode_with_granularity(granularity + 1)
                 if len(self.index.entries) == 1:
                     # index is empty (except for y=0), so don't index image.
-                    granularity = self.region.height()
+                    granularity = self._height
+                    probe = (self._data, self.index)
                     break
-                if max(self.index.entries) > self.index_granularity.value:
+                if self.index.max_entry > self.index_granularity.value:
                     break
+                probe = (self._data, self.index)
                 granularity += 1
             if granularity == 0:
                 # cannot achieve specified index granularity (size too low)
@@ -246,7 +295,11 @@ class ImageEncoder(abc.ABC):
         else:
             granularity = self.index_granularity.value
 
-        self._encode_with_granularity(granularity)
+        if probe and probe[1].granularity == granularity:
+            # image was already encoded with that granularity during search.
+            self._data, self.index = probe
+        else:
+            self._encode_with_granularity(granularity)
 
         if len(self.index.entries) == 1 or self._flags & ImageData.FLAG_RAW:
             self._indexed = False
@@ -258,8 +311,7 @@ class ImageEncoder(abc.ABC):
                 raise EncodeError("cannot achieve specified index granularity (too many rows)")
 
         return ImageData(self._flags, self.alpha_color,
-                         self.region.width(), self.region.height(),
-                         self.index, self._data)
+                         self._width, self._height, self.index, self._data)
 
     def _get_max_run_length(self) -> int:
         """Get the maximum run length that can be encoded by this encoder.
@@ -608,6 +660,9 @@ class ImageObject(DataObject):
     def is_in_unified_data_space(self) -> bool:
         return True
 
+    def get_source_file(self) -> Optional[Path]:
+        return self.file
+
     def get_type_name(self) -> str:
         return "image"
 
@@ -639,7 +694,7 @@ def register_helper(packer) -> None:
 
 def create_config(args: argparse.Namespace) -> Config:
     input_file = Path(args.input_file)
-    if not input_file.exists() or not input_file.is_file():
+    if not input_file.is_file():
         raise EncodeError("invalid input file")
 
     output_file = args.output_file
@@ -749,19 +804,11 @@ def create_image_data(config: Config) -> ImageData:
     # transparent is treated as black during this check.
     # also list colors present in image to choose color to treat as alpha.
     levels = ImageEncoderGray.get_gray_levels()
-    colors = set()
-    has_alpha = False
-    auto_bit_depth = (config.encoding.binary is None)
-    if auto_bit_depth:
-        config.encoding.binary = True
-    for px in pixel_iterator(image, levels, config.region):
-        if px == TRANSPARENT_COLOR:
-            has_alpha = True
-            continue
-        if not config.opaque:
-            colors.add(px)
-        if auto_bit_depth and px != 0 and px != levels - 1:
-            config.encoding.binary = False
+    colors = set(read_region(image, levels, config.region))
+    has_alpha = TRANSPARENT_COLOR in colors
+    colors.discard(TRANSPARENT_COLOR)
+    if config.encoding.binary is None:
+        config.encoding.binary = colors <= {0, levels - 1}
 
     alpha_color = ImageEncoder.ALPHA_COLOR_NONE
     if has_alpha and not config.opaque and not config.encoding.binary:
@@ -26,24 +26,32 @@
 # $ ./sound_gen.py --help
 #
 import argparse
+import array
+import heapq
 import math
+import struct
 import sys
 from collections import Counter
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Set
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Iterator, Any
 
-from mido import MidiFile
+import numpy as np
+from mido import MidiFile, MidiTrack
 
 sys.path.append(str(Path(__file__).absolute().parent.parent))  # for standalone run
 from assets.types import PackResult, DataObject, PackError
 
-FramesNotes = List[List[List[int]]]
+# notes played on each frame for each MIDI track. snapshots are shared between frames.
+FramesNotes = List[List[Tuple[int, ...]]]
 MidiEventMap = Dict[int, List[Tuple[int, any]]]
-MidiTempoMap = Dict[int, int]
+# tempo changes (MIDI time, tempo in us/beat), sorted by time.
+MidiTempoMap = List[Tuple[int, int]]
 
 
+@lru_cache(maxsize=256)
 def get_note_freq(note: int) -> float:
     """Return the frequency of a note value in Hz (C2=0)."""
     return 440 * 2 ** ((note - 33) / 12)
@@ -53,13 +61,8 @@ class EncodeError(Exception):
     pass
 
 
-@dataclass
 class NoteData:
-    # note as encoded in sound data, C2 is 0, B7 is 71
-    note: int
-    # duration, 0-MAX_DURATION (0 being 1/16th of a beat)
-    duration: int
-
+    """Constants and helpers for the encoding of track notes."""
     NONE = 0x54
     MAX_DURATION = 0x3fff
     MAX_DURATION_REPEAT = 0x40
@@ -71,34 +74,36 @@ class NoteData:
     # minimum note resolution for buzzer sound system (1/16th of a beat).
     TIMEFRAME_RESOLUTION = 16
 
-    def encode_duration(self) -> bytes:
-        """Encode the duration of a note in one or two bytes."""
-        b = bytearray()
-        if self.duration < 128:
-            b.append(self.duration)
-        elif self.duration <= NoteData.MAX_DURATION:
-            b.append((self.duration >> 8) | 0xc0)
-            b.append(self.duration & 0xff)
+    # encoded durations shorter than 128, which take a single byte.
+    SHORT_DURATIONS = tuple(bytes((d,)) for d in range(128))
+
+    @staticmethod
+    def encode_duration(duration: int) -> bytes:
+        """Encode a note duration in one or two bytes."""
+        if duration < 128:
+            return NoteData.SHORT_DURATIONS[duration]
+        elif duration <= NoteData.MAX_DURATION:
+            # two bytes, big endian, with the two most significant bits set.
+            return struct.pack(">H", duration | 0xc000)
         else:
             raise ValueError("cannot encode duration")
-        return b
 
     @staticmethod
     def from_midi(midi_note: int):
         # C2=36 in MIDI, C2=0 in buzzer sound
         return midi_note - 36
 
-    def __repr__(self) -> str:
-        note_str = "OFF" if self.note == NoteData.NONE else self.note
-        return f"BuzzerNote(note={note_str}, duration={self.duration})"
-
 
-@dataclass
 class TrackData:
     # channel number
     channel: int
-    # track notes
-    notes: List[NoteData]
+    # track notes as encoded in sound data (C2 is 0, B7 is 71, or NoteData.NONE),
+    # and their duration, 0-MAX_DURATION (0 being 1/16th of a beat), in parallel arrays.
+    note_arr: array.array
+    dur_arr: array.array
+    # note currently playing, or last note played before the current pause.
+    # NONE if nothing was played yet or after a pause longer than the maximum duration.
+    last_note: int
 
     TRACK_NOTES_END = 0xff
 
@@ -107,24 +112,52 @@ class TrackData:
 
     def __init__(self, number: int):
         self.channel = number
-        self.notes = []
+        self.note_arr = array.array("B")
+        self.dur_arr = array.array("H")
+        self.last_note = NoteData.NONE
+
+    def __repr__(self) -> str:
+        return f"TrackData(channel={self.channel})"
 
     def add_note(self, note: int) -> None:
         """append note at the end of track, merge with previous note if identical"""
-        if note != NoteData.NONE and note not in TrackData.NOTE_RANGE:
+        if note == NoteData.NONE:
+            self.add_none_note()
+            return
+        if note not in TrackData.NOTE_RANGE:
             raise ValueError("Note out of range for track")
-        if len(self.notes) > 0 and self.notes[-1].note == note and \
-                self.notes[-1].duration < NoteData.MAX_DURATION:
-            self.notes[-1].duration += 1
-        else:
-            # different note, or previous note exceeded max duration.
-            self.notes.append(NoteData(note, 0))
+        notes = self.note_arr
+        durations = self.dur_arr
+        if notes and notes[-1] == note and durations[-1] < NoteData.MAX_DURATION:
+            durations[-1] += 1
+            return
+        # different note, or previous note exceeded max duration.
+        self.last_note = note
+        notes.append(note)
+        durations.append(0)
+
+    def add_none_note(self) -> None:
+        """Same as `add_note` for a "none" note, which needs no range check.
+        Called for every idle track on every frame."""
+        notes = self.note_arr
+        durations = self.dur_arr
+        if notes and notes[-1] == NoteData.NONE:
+            if durations[-1] < NoteData.MAX_DURATION:
+                durations[-1] += 1
+                return
+            # pause exceeded max duration, nothing played before new pause.
+            self.last_note = NoteData.NONE
+        notes.append(NoteData.NONE)
+        durations.append(0)
 
     def finalize(self) -> None:
         """do final modifications on track notes"""
         # remove last 'none' notes if any
-        while len(self.notes) > 0 and self.notes[-1].note == NoteData.NONE:
-            del self.notes[-1]
+        end = len(self.note_arr)
+        while end > 0 and self.note_arr[end - 1] == NoteData.NONE:
+            end -= 1
+        del self.note_arr[end:]
+        del self.dur_arr[end:]
 
     def encode(self) -> bytes:
         last_duration = -1
@@ -132,21 +165,18 @@ class TrackData:
         first_repeat_index = -1
         last_note_index = -1
 
-        b = bytearray()
-        b.append(self.channel)
-        b += b"\x00\x00"  # track length
+        # header: channel, track length (set at the end), immediate pause duration (set below).
+        b = bytearray((self.channel, 0x00, 0x00, 0x00))
 
         # find most common pause duration shorter than 256 for track and store it
         # it will be used for notes using the immediate pause encoding.
+        # on a tie, the duration that occurs first is used.
         immediate_pause = -1
-        b.append(0)
-        if self.notes:
-            pause_durations = (note.duration for note in self.notes
-                               if note.note == NoteData.NONE and note.duration <= 0xff)
-            most_common_pauses = Counter(pause_durations).most_common()
-            if most_common_pauses:
-                immediate_pause = most_common_pauses[0][0]
-                b[-1] = immediate_pause
+        pause_counts = Counter(duration for note, duration in zip(self.note_arr, self.dur_arr)
+                               if note == NoteData.NONE and duration <= 0xff)
+        if pause_counts:
+            immediate_pause = pause_counts.most_common(1)[0][0]
+            b[3] = immediate_pause
 
         def end_duration_repeat() -> None:
             nonlocal duration_repeat, first_repeat_index
@@ -155,24 +185,24 @@ class TrackData:
                 duration_repeat = 0
                 first_repeat_index = -1
 
-        for note in self.notes:
+        for note, duration in zip(self.note_arr, self.dur_arr):
             # append note byte
-            if note.note == NoteData.NONE:
-                if note.duration == immediate_pause and last_note_index != -1:
+            if note == NoteData.NONE:
+                if duration == immediate_pause and last_note_index != -1:
                     # note in range [0x55, 0xa8] indicate that note is followed by a pause.
                     b[last_note_index] += NoteData.IMMEDIATE_PAUSE_OFFSET
                     last_note_index = -1
                     continue
-                elif note.duration <= (0xff - NoteData.SHORT_PAUSE_OFFSET):
+                elif duration <= (0xff - NoteData.SHORT_PAUSE_OFFSET):
                     # note in range [0xaa, 0xfe] indicate a pause of duration (note - 170).
-                    b.append(note.duration + NoteData.SHORT_PAUSE_OFFSET)
+                    b.append(duration + NoteData.SHORT_PAUSE_OFFSET)
                     continue
-                elif 128 < note.duration <= 129 + immediate_pause and immediate_pause <= 128:
+                elif 128 < duration <= 129 + immediate_pause and immediate_pause <= 128:
                     # 0xa9
                     # will almost never happen but if pause is in a narrow duration range
                     # it can be encoded on 2 bytes instead of 3 by combining with immediate pause
                     b.append(NoteData.NONE + NoteData.IMMEDIATE_PAUSE_OFFSET)
-                    note = NoteData(note.note, note.duration - immediate_pause - 1)
+                    duration -= immediate_pause + 1
                 else:
                     # 0x54: normal pause
                     last_note_index = len(b)
@@ -180,10 +210,10 @@ class TrackData:
             else:
                 # note in range [0, 84[ indicate only a note.
                 last_note_index = len(b)
-                b.append(note.note)
+                b.append(note)
 
             # append duration
-            if note.duration == last_duration:
+            if duration == last_duration:
                 # same duration as last note, use repeated duration encoding
                 if duration_repeat == NoteData.MAX_DURATION_REPEAT:
                     end_duration_repeat()
@@ -192,9 +222,10 @@ class TrackData:
                     b.append(0x00)  # to be set later
                 duration_repeat += 1
             else:
-                end_duration_repeat()
-                b += note.encode_duration()
-                last_duration = note.duration
+                if duration_repeat > 0:
+                    end_duration_repeat()
+                b += NoteData.encode_duration(duration)
+                last_duration = duration
 
         end_duration_repeat()
 
@@ -219,17 +250,19 @@ class SoundData:
     TEMPO_MIN_US = round(256 * TEMPO_SLICE * NoteData.TIMEFRAME_RESOLUTION)
     TEMPO_MAX_US = round(1 * TEMPO_SLICE * NoteData.TIMEFRAME_RESOLUTION)
 
-    def encode(self) -> bytes:
+    def iter_encoded(self) -> Iterator[bytes]:
+        """Encode sound data chunk by chunk: signature, each track, then end marker."""
         if len(set(t.channel for t in self.tracks)) != len(self.tracks):
             raise EncodeError("tracks must be unique")
 
-        b = bytearray()
-        b.append(SoundData.SIGNATURE)
+        yield bytes((SoundData.SIGNATURE,))
         for track in self.tracks:
-            if len(track.notes) > 0:
-                b += track.encode()
-        b.append(SoundData.SOUND_END)
-        return b
+            if len(track.note_arr) > 0:
+                yield track.encode()
+        yield bytes((SoundData.SOUND_END,))
+
+    def encode(self) -> bytes:
+        return b"".join(self.iter_encoded())
 
 
 class ClosestTrackStrategy:
@@ -256,14 +289,11 @@ class ClosestTrackStrategy:
         # which MIDI track a buzzer track has been set to, or None if none yet.
         midi_track_assignment: List[Optional[int]] = [None] * SoundData.CHANNELS_COUNT
 
-        def filter_tracks(track: TrackData):
-            midi_asg = midi_track_assignment[track.channel]
-            return (bnote in TrackData.NOTE_RANGE and
-                    (self.merge_midi_tracks or midi_asg is None or midi_track == midi_asg))
-
+        # channels of unassigned tracks for current frame, reused for all frames.
+        unassigned: Set[int] = set()
         for i in range(len(frames_notes[0])):
-            # unassigned tracks for current frame
-            unassigned_tracks = {channel: track for channel, track in tracks.items()}
+            unassigned.clear()
+            unassigned.update(tracks.keys())
 
             for midi_track, midi_track_notes in enumerate(frames_notes):
                 for note in midi_track_notes[i]:
@@ -271,15 +301,21 @@ class ClosestTrackStrategy:
 
                     # filter available tracks to keep only tracks which have had no note
                     # assigned yet to them or tracks which have had notes from this MIDI track.
-                    # also keep only tracks on which note can be played
-                    legal_tracks = list(filter(filter_tracks, unassigned_tracks.values()))
+                    # also keep only tracks on which note can be played.
+                    # tracks are kept in channel order, which matters for track assignment.
+                    legal_tracks = []
+                    if bnote in TrackData.NOTE_RANGE:
+                        legal_tracks = [track for channel, track in tracks.items()
+                                        if channel in unassigned and
+                                        (self.merge_midi_tracks or
+                                         midi_track_assignment[channel] in (None, midi_track))]
                     if not legal_tracks:
                         raise EncodeError("could not assign note to track")
 
                     # apply strategy to choose track for note
                     track_num = self.assign_track(legal_tracks, bnote)
 
-                    del unassigned_tracks[track_num]
+                    unassigned.remove(track_num)
                     if midi_track_assignment[track_num] is None:
                         # first note assigned to this track, remember which MIDI track
                         midi_track_assignment[track_num] = midi_track
@@ -287,17 +323,17 @@ class ClosestTrackStrategy:
                     tracks[track_num].add_note(bnote)
 
             # add "none" notes for remaining unassigned tracks
-            for track in unassigned_tracks.values():
-                track.add_note(NoteData.NONE)
+            for channel in unassigned:
+                tracks[channel].add_none_note()
 
         for track in tracks.values():
             track.finalize()
 
         # discard tracks with only a single "none" note
-        return list(filter(lambda t: len(t.notes) > 0, tracks.values()))
+        return [track for track in tracks.values() if len(track.note_arr) > 0]
 
     def assign_track(self, tracks: List[TrackData], bnote: int) -> int:
-        if len(tracks[0].notes) == 0:
+        if len(tracks[0].note_arr) == 0:
             # no notes assigned yet, fallback on first fit.
             return tracks[0].channel
 
@@ -305,15 +341,13 @@ class ClosestTrackStrategy:
         closest_track: Optional[int] = None
         closest_count = 0
         min_note_dist = 0
-        for i, track in enumerate(tracks):
-            curr_note = track.notes[-1].note
-            if curr_note == NoteData.NONE and len(track.notes) > 1:
-                curr_note = track.notes[-2].note
+        for track in tracks:
+            curr_note = track.last_note
             note_dist = math.inf if curr_note == NoteData.NONE else abs(bnote - curr_note)
             if closest_track is None or note_dist < min_note_dist or \
-                    (note_dist == min_note_dist and len(track.notes) > closest_count):
+                    (note_dist == min_note_dist and len(track.note_arr) > closest_count):
                 closest_track = track.channel
-                closest_count = len(track.notes)
+                closest_count = len(track.note_arr)
                 min_note_dist = note_dist
 
         return closest_track
@@ -334,6 +368,7 @@ def beat_us_to_bpm(us: float) -> float:
     return 6e7 / us
 
 
+@lru_cache(maxsize=256)
 def format_midi_note(note: int) -> str:
     """Convert midi note 0-127 to note name."""
     return f"{NOTE_NAMES[note % 12]}{note // 12 - 1}"
@@ -385,6 +420,9 @@ class SoundObject(DataObject):
     def is_in_unified_data_space(self) -> bool:
         return True
 
+    def get_source_file(self) -> Optional[Path]:
+        return self.file
+
     def get_type_name(self) -> str:
         return "sound"
 
@@ -405,7 +443,7 @@ def register_builder(packer) -> None:
 def create_config(args: argparse.Namespace) -> Config:
     """Validate input arguments and create typed configuration object."""
     input_path = Path(args.input_file)
-    if not input_path.exists() or not input_path.is_file():
+    if not input_path.is_file():
         raise ValueError("input file doesn't exist")
 
     # tempo
@@ -493,24 +531,37 @@ class SoundEncoder:
 
     def _build_event_map(self, midi: MidiFile) -> MidiEventMap:
         """Group midi messages in all the tracks by the time at which they occur
-        keep track of the original track number."""
-        event_map: MidiEventMap = {}
-        for i, track in enumerate(midi.tracks):
+        keep track of the original track number. Tracks are merged in time order,
+        so the map is also ordered by time."""
+
+        def track_events(track_num: int, track: MidiTrack) -> Iterator[Tuple[int, int, Any]]:
             time = 0
             for event in track:
                 time += event.time
-                if time not in event_map:
-                    event_map[time] = []
-                event_map[time].append((i, event))
+                yield time, track_num, event
+
+        event_map: MidiEventMap = {}
+        # events at the same time are kept in track order, then in order within the track.
+        for time, track_num, event in heapq.merge(
+                *(track_events(i, track) for i, track in enumerate(midi.tracks)),
+                key=lambda e: e[0]):
+            if time not in event_map:
+                event_map[time] = []
+            event_map[time].append((track_num, event))
         return event_map
 
     def _get_tempo_map(self, event_map: MidiEventMap) -> MidiTempoMap:
-        """Build MIDI tempo map (tempo in us/beat by MIDI time)."""
-        tempo_map: MidiTempoMap = {0: 500000}
+        """Build MIDI tempo map (tempo in us/beat by MIDI time). Event map is ordered by time,
+        so the tempo map is built sorted."""
+        tempo_map: MidiTempoMap = [(0, 500000)]
         for time, events in event_map.items():
             tempo_event = next((e[1] for e in events if e[1].type == "set_tempo"), None)
             if tempo_event:
-                tempo_map[time] = tempo_event.tempo
+                if time == tempo_map[-1][0]:
+                    # replaces default tempo at the start of file.
+                    tempo_map[-1] = (time, tempo_event.tempo)
+                else:
+                    tempo_map.append((time, tempo_event.tempo))
         return tempo_map
 
     def _get_average_tempo(self, tempo_map: MidiTempoMap, midi_duration: int) -> float:
@@ -518,7 +569,7 @@ class SoundEncoder:
         avg_tempo = 0
         curr_tempo = 0
         last_tempo_time = 0
-        for time, tempo in sorted(tempo_map.items()):
+        for time, tempo in tempo_map:
             avg_tempo += curr_tempo * (time - last_tempo_time)
             curr_tempo = tempo
             last_tempo_time = time
@@ -527,55 +578,99 @@ class SoundEncoder:
         return avg_tempo
 
     def _get_all_frames(self, tempo_map: MidiTempoMap, tempo: float, midi_duration: int,
-                        ticks_per_beat: int) -> List[int]:
+                        ticks_per_beat: int) -> np.ndarray:
         """From average tempo, event map and tempo map, compute the MIDI clock for each 1/16th
         of beat, for the duration of the whole file, while accounting for variable tempo."""
-        frames: List[int] = []
+        # Between tempo changes, time advances by a constant step on each frame, so the time of
+        # all frames in a tempo segment is computed at once with a cumulative sum. This gives
+        # exactly the same values as adding the step frame by frame. A new tempo takes effect
+        # on the first frame at or after its time, a single tempo change per frame.
+        segments: List[np.ndarray] = []
         midi_ticks = 0.0
-        tempo_map_sorted = sorted(tempo_map.items())
-        curr_tempo = None
-        while midi_ticks < midi_duration:
-            if not curr_tempo or tempo_map_sorted and midi_ticks >= tempo_map_sorted[0][0]:
-                curr_tempo = tempo_map_sorted[0][1]
-                del tempo_map_sorted[0]
-            frames.append(round(midi_ticks))
+        for i, (_, curr_tempo) in enumerate(tempo_map):
+            if midi_ticks >= midi_duration:
+                break
             # advance time to go to next timeframe, using average tempo as reference tempo
             # and taking clocks per tick into account
-            midi_ticks += (tempo / curr_tempo) * ticks_per_beat / NoteData.TIMEFRAME_RESOLUTION
-        return frames
-
-    def _get_frame_notes(self, event_map: MidiEventMap, frames: List[int],
+            step = (tempo / curr_tempo) * ticks_per_beat / NoteData.TIMEFRAME_RESOLUTION
+            segment_end = midi_duration
+            if i + 1 < len(tempo_map):
+                segment_end = min(segment_end, tempo_map[i + 1][0])
+            count = max(1, math.ceil((segment_end - midi_ticks) / step) + 1)
+            while True:
+                ticks = np.cumsum(np.concatenate(([midi_ticks], np.full(count, step))))
+                # first frame after the start of the segment that is in the next segment.
+                end = int(np.searchsorted(ticks[1:], segment_end)) + 1
+                if end < len(ticks):
+                    break
+                # rounding errors made the estimated frame count too small.
+                count *= 2
+            segments.append(ticks[:end])
+            midi_ticks = ticks[end]
+        if not segments:
+            return np.array([], dtype=np.int64)
+        return np.rint(np.concatenate(segments)).astype(np.int64)
+
+    def _get_frame_notes(self, event_map: MidiEventMap, frames: np.ndarray,
                          track_count: int) -> FramesNotes:
         """Get all notes being played on each frame and in between frames, for each MIDI track.
         detect when notes go on and off during same frame to prevent omitting notes."""
+        # flatten note events in time order, with their MIDI track, type, note,
+        # and the bit for the note in the mask of notes on (MIDI notes are 0-127).
+        octave_offset = round(self.config.octave_adjust * 12)
+        event_times: List[int] = []
+        note_events: List[Tuple[int, bool, int, int]] = []
+        for time, events in event_map.items():
+            for track_num, event in events:
+                if event.type == "note_on" or event.type == "note_off":
+                    event_times.append(time)
+                    note_events.append((track_num, event.type == "note_on",
+                                        event.note + octave_offset, 1 << event.note))
+
+        # find the range of events for all frames at once. a frame gets all events in between
+        # itself and the next frame, in order to not miss any events. the last frame (and any
+        # frame at the same time as the next one) only gets events occurring at its time.
+        frame_end = np.maximum(np.append(frames[1:], 0), frames + 1)
+        event_times_arr = np.array(event_times, dtype=np.int64)
+        first_events = np.searchsorted(event_times_arr, frames).tolist()
+        last_events = np.searchsorted(event_times_arr, frame_end).tolist()
+
         timelines: FramesNotes = [[] for _ in range(track_count)]
+        # notes on per track, in the order they started playing (which matters for
+        # track assignment), and a mask of the same notes to test if a note is on.
         notes_on: List[List[int]] = [[] for _ in range(track_count)]
-        new_notes_on = set()
-        for i, frame in enumerate(frames):
-            events = list(event_map.get(frame, []))
-            if i != len(frames) - 1:
-                # also get all events in between this frame and the next,
-                # in order to not miss any events
-                for j in range(frame + 1, frames[i + 1]):
-                    events += event_map.get(j, [])
+        notes_on_mask: List[int] = [0] * track_count
+        # whether notes on changed since the last snapshot, per track.
+        notes_changed: List[bool] = [True] * track_count
+        for i, (first_event, last_event) in enumerate(zip(first_events, last_events)):
+            if first_event == last_event and i > 0:
+                # no events in frame, notes haven't changed since last snapshot on any track.
+                for timeline in timelines:
+                    timeline.append(timeline[-1])
+                continue
 
             # update list of notes on per track
-            for track_num, event in events:
-                notes_on_track = notes_on[track_num]
-                new_notes_on.clear()
-                if event.type == "note_on" or event.type == "note_off":
-                    note = event.note + round(self.config.octave_adjust * 12)
-                    if event.type == "note_on" and note not in notes_on_track:
-                        # start playing note. if note_on event and note is already being played,
-                        # interpret as note_off (?).
-                        notes_on_track.append(note)
-                        new_notes_on.add(note)
-                    elif note in notes_on_track:
-                        notes_on_track.remove(note)
-
-            # save notes for frame
+            for track_num, is_note_on, note, note_bit in note_events[first_event:last_event]:
+                is_on = notes_on_mask[track_num] & note_bit
+                if is_note_on and not is_on:
+                    # start playing note. if note_on event and note is already being played,
+                    # interpret as note_off (?).
+                    notes_on[track_num].append(note)
+                    notes_on_mask[track_num] |= note_bit
+                    notes_changed[track_num] = True
+                elif is_on:
+                    notes_on[track_num].remove(note)
+                    notes_on_mask[track_num] &= ~note_bit
+                    notes_changed[track_num] = True
+
+            # save notes for frame. snapshots are immutable, so if notes haven't changed
+            # since last frame, the last snapshot is reused instead of copying the notes.
             for j, timeline in enumerate(timelines):
-                timeline.append(list(notes_on[j]))
+                if notes_changed[j]:
+                    timeline.append(tuple(notes_on[j]))
+                    notes_changed[j] = False
+                else:
+                    timeline.append(timeline[-1])
 
         return timelines
 
@@ -615,13 +710,15 @@ class SoundEncoder:
     def _check_max_notes_at_once(self, frames_notes: FramesNotes, tempo: float) -> None:
         """Check if maximum number of notes played at once in all tracks combined is
         less or equal to the number of channels."""
-        nframes = len(frames_notes[0])
-        notes_per_frame = [sum(len(notes[i]) for notes in frames_notes) for i in range(nframes)]
-        max_notes = max(notes_per_frame)
+        # count notes for each track and frame, then sum the tracks for each frame.
+        notes_per_track = np.array([[len(notes) for notes in track_notes]
+                                    for track_notes in frames_notes], dtype=np.int32)
+        notes_per_frame = notes_per_track.sum(axis=0)
+        max_notes = int(notes_per_frame.max())
         if max_notes > SoundData.CHANNELS_COUNT:
             # more notes played at once than channels available.
             # give some info on time of occurence in file.
-            time = (notes_per_frame.index(max_notes) /
+            time = (int(notes_per_frame.argmax()) /
                     (NoteData.TIMEFRAME_RESOLUTION * 1e6) * tempo)
             raise EncodeError(f"can't convert, up to {max_notes} notes played at once "
                               f"(at around {time:.1f} s, only {SoundData.CHANNELS_COUNT} "
@@ -633,8 +730,13 @@ class SoundEncoder:
         """Check that no note in file exceeds the largest timer range and
         give some information on notes and timing if bad notes found."""
         for track_notes in frames_notes:
+            last_notes = None
             for i, frame_notes in enumerate(track_notes):
-                for j, note in enumerate(frame_notes):
+                if frame_notes is last_notes:
+                    # same snapshot as previous frame, notes were already checked.
+                    continue
+                last_notes = frame_notes
+                for note in frame_notes:
                     if not NoteData.from_midi(note) in TrackData.NOTE_RANGE:
                         # bad note, give some info on it
                         # given time is approximate since based on overall tempo.
@@ -696,19 +798,21 @@ def main() -> None:
         print(f"ERROR: {e}", file=sys.stderr)
         exit(1)
 
-    # output encoded data
-    data = sound_data.encode()
-    if config.verbose:
-        print(f"Total data size is {len(data)} bytes")
+    # output encoded data, one chunk at a time
+    size = 0
     try:
         if config.output_file == STD_IO:
-            sys.stdout.buffer.write(data)
+            for chunk in sound_data.iter_encoded():
+                size += sys.stdout.buffer.write(chunk)
             sys.stdout.flush()
         else:
             with open(config.output_file, "wb") as file:
-                file.write(data)
+                for chunk in sound_data.iter_encoded():
+                    size += file.write(chunk)
     except IOError as e:
         raise EncodeError(f"could not write to output file: {e}") from e
+    if config.verbose:
+        print(f"Total data size is {size} bytes")
 
 
 if __name__ == '__main__':
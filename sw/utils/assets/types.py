@@ -15,6 +15,8 @@
 import abc
 from dataclasses import dataclass, field
 from enum import Enum
+from pathlib import Path
+from typing import Optional
 
 from utils import readable_size
 
@@ -50,6 +52,16 @@ class DataObject(abc.ABC):
         """Whether the object address should be given in unified data space."""
         return False
 
+    def can_pack_concurrently(self) -> bool:
+        """Whether the object can be packed in a worker thread, concurrently with other objects.
+        Objects printing output while packing should return False so that it isn't interleaved."""
+        return True
+
+    def get_source_file(self) -> Optional[Path]:
+        """Returns the file from which the object is created, if any.
+        The pack result of such objects is cached and reused while the file is unchanged."""
+        return None
+
     def get_type_name(self) -> str:
         """Returns a lowercase string indicating the type of this data object."""
         raise NotImplementedError
@@ -11,22 +11,29 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
-import math
+import inspect
 import os
+import pickle
 import re
+import string
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from enum import Enum
+from hashlib import sha256
 from pathlib import Path
 from typing import Any, List, Callable, Optional, Union, NoReturn, Dict, Set, Tuple, Generator, \
     Iterable
 
+import mido
+import numpy as np
+import PIL
 from PIL import Image
 from assets import font_gen, image_gen, sound_gen
 from assets.codegen import CodeGenerator
 from assets.types import DataObject, PackResult, PackError, Location
 # name of the file used to save packed assets data
-from utils import PathLike, print_progress_bar, readable_size
+from utils import PathLike, print_progress_bar, readable_size, pack_uints
 
 # name of the generated packed assets file
 ASSETS_FILE = "assets.dat"
@@ -37,6 +44,15 @@ SOURCE_FILE = "src/assets.c"
 
 # name of the assets directory (that's the working directory when packing).
 ASSETS_DIR = "assets"
+# directory where pack results of objects created from a file are cached.
+CACHE_DIR = Path(ASSETS_DIR, "cache")
+
+# characters allowed in object, group and define names (after conversion to lowercase).
+NAME_CHARS = frozenset(string.ascii_lowercase + string.digits + "_")
+# table used to replace separators with underscores when deducing a name from a filename.
+NAME_SEPARATORS_TABLE = str.maketrans("- .", "___")
+# pattern used to collapse consecutive underscores in names deduced from a filename.
+NAME_UNDERSCORES_PATTERN = re.compile(r"_+")
 
 
 class ArrayType(Enum):
@@ -103,7 +119,8 @@ def register_builtin_builders(packer) -> None:
 
 
 def uint_width_for_max(value: int) -> int:
-    return math.ceil(math.log2(value) / 8)
+    """Returns the number of bytes of the smallest unsigned integer type that can hold a value."""
+    return max(1, (value.bit_length() + 7) // 8)
 
 
 class GeneratorWrapper:
@@ -129,10 +146,7 @@ class ArrayIndexObject(DataObject):
 
     def pack(self) -> PackResult:
         addr_bytes = uint_width_for_max(self.address[-1])
-        data = bytearray()
-        for addr in self.address:
-            data += addr.to_bytes(addr_bytes, "little")
-        return ArrayIndexPackResult(data, addr_bytes)
+        return ArrayIndexPackResult(pack_uints(self.address, addr_bytes, "little"), addr_bytes)
 
     def get_type_name(self) -> str:
         return "array index"
@@ -157,9 +171,11 @@ class Packer:
     _defines: Dict[str, int]
     _group_names: Set[str]
     _array_types: Dict[str, ArrayType]
+    _array_indexes: Dict[str, PackObject]
     _curr_group: List[str]
     _is_in_array: bool
     _location: Location
+    _cache_files: Set[Path]
 
     # byte value used for padding in regular arrays
     PADDING_BYTE = b"\xff"
@@ -175,9 +191,11 @@ class Packer:
         self._defines = {}
         self._group_names = set()
         self._array_types = {}
+        self._array_indexes = {}
         self._curr_group = []
         self._is_in_array = False
         self._location = Location.FLASH
+        self._cache_files = set()
 
         # register builders for built-in object types
         register_builtin_builders(self)
@@ -210,7 +228,7 @@ class Packer:
         name = name.strip().lower()
         if not name:
             self._error("object name cannot be blank", len(self._objects))
-        if not re.match(r"^[a-z\d_]+$", name):
+        if not NAME_CHARS.issuperset(name):
             self._error(f"invalid object name '{name}'", len(self._objects))
         return name
 
@@ -236,7 +254,7 @@ class Packer:
             self._error("arrays cannot contain groups or other arrays")
 
         name = name.lower()
-        if not re.match(r"^[a-z\d_]+$", name):
+        if not name or not NAME_CHARS.issuperset(name):
             self._error(f"group name '{name}' is invalid.")
 
         self._curr_group.append(name)
@@ -323,12 +341,12 @@ class Packer:
         def wrapper(*args, name: Optional[str] = None, **kwargs) -> Any:
             filename = args[0]
             filename = filename if isinstance(filename, Path) else Path(ASSETS_DIR, filename)
-            if not filename.exists():
+            if not filename.is_file():
                 self._error(f"file '{filename}' doesn't exist", len(self._objects))
             if name is None:
                 # deduce name from filename
                 name = filename.stem.lower()
-                name = re.sub(r"[-_ .]+", "_", name)
+                name = NAME_UNDERSCORES_PATTERN.sub("_", name.translate(NAME_SEPARATORS_TABLE))
 
             try:
                 gen = GeneratorWrapper(func(filename, *args[1:], **kwargs))
@@ -350,7 +368,7 @@ class Packer:
         """Add an extra #define macro to generate in assets header file.
         The define name is prefixed with the current group name and may be prefixed with ASSET_"""
         name_lower = name.strip().lower()
-        if not re.match(r"^[a-z\d_]+$", name_lower):
+        if not name_lower or not NAME_CHARS.issuperset(name_lower):
             self._error(f"bad define name '{name}'")
         full_name = f"{self._curr_group_name()}_{name_lower}"
         if asset_prefix:
@@ -421,17 +439,102 @@ class Packer:
             yield self._objects[array_start:]
 
     def _pack_assets(self) -> None:
-        """Pack all objects and show progress."""
+        """Pack all objects and show progress. Objects are independent so most are packed
+        concurrently, but results are collected (and errors reported) in order.
+        Identical objects (e.g. same file with same options) are only packed once."""
         n = len(self._objects)
+        cache_key = self._get_cache_key()
         progress = print_progress_bar("Packing objects", " objects", lambda v: v)
-        for i, obj in enumerate(self._objects):
-            progress(i, n)
-            try:
-                obj.result = obj.data.pack()
-            except PackError as e:
-                self._error(e, obj)
+        results: Dict[str, PackResult] = {}
+        error: Optional[Tuple[PackError, PackObject]] = None
+        with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, 16)) as executor:
+            # data objects often have unhashable fields (sets, regions, etc),
+            # so their representation is used to identify them instead.
+            keys = [repr(obj.data) for obj in self._objects]
+            futures = {}
+            for key, obj in zip(keys, self._objects):
+                if key not in futures and obj.data.can_pack_concurrently():
+                    futures[key] = executor.submit(self._pack_object, obj.data, cache_key)
+            for i, (obj, key) in enumerate(zip(self._objects, keys)):
+                progress(i, n)
+                try:
+                    if key not in results:
+                        if key in futures:
+                            results[key] = futures[key].result()
+                        else:
+                            # object can't be packed concurrently, pack it now.
+                            results[key] = self._pack_object(obj.data, cache_key)
+                    obj.result = results[key]
+                except PackError as e:
+                    # cancel objects not packed yet, the executor waits for them on exit.
+                    for future in futures.values():
+                        future.cancel()
+                    error = e, obj
+                    break
+        if error:
+            self._error(*error)
         progress(n, n)
         print()
+        self._prune_cache()
+
+    @staticmethod
+    def _get_cache_key() -> bytes:
+        """Returns the part of the cache key shared by all objects: pack results contain classes
+        from the types module and depend on the version of libraries used to create them."""
+        sha = sha256(f"{PIL.__version__} {mido.version_info} {np.__version__}".encode())
+        with open(inspect.getfile(DataObject), "rb") as file:
+            sha.update(file.read())
+        return sha.digest()
+
+    def _pack_object(self, data: DataObject, cache_key: bytes) -> PackResult:
+        """Pack a single object. Objects created from a file are cached on disk, the cache key
+        is made from the object, the file content, the module implementing the object and the
+        key shared by all objects, so that a change to any of them invalidates the cached result."""
+        source_file = data.get_source_file()
+        if source_file is None:
+            return data.pack()
+
+        sha = sha256(cache_key)
+        sha.update(repr(data).encode())
+        try:
+            for filename in (source_file, inspect.getfile(type(data))):
+                with open(filename, "rb") as file:
+                    sha.update(file.read())
+        except IOError as e:
+            raise PackError(f"could not read file: {e}")
+
+        cached_file = CACHE_DIR / f"{sha.hexdigest()[:16]}.pickle"
+        self._cache_files.add(cached_file)
+        if cached_file.is_file():
+            try:
+                with open(cached_file, "rb") as file:
+                    return pickle.load(file)
+            except Exception:
+                # cached result is unusable (e.g. it refers to a class that changed),
+                # pack the object again.
+                pass
+
+        result = data.pack()
+        try:
+            # write to a temporary file first so that an interrupted write is never used.
+            CACHE_DIR.mkdir(exist_ok=True)
+            temp_file = cached_file.with_suffix(".tmp")
+            with open(temp_file, "wb") as file:
+                pickle.dump(result, file)
+            os.replace(temp_file, cached_file)
+        except IOError:
+            # caching is only an optimization, ignore failures.
+            pass
+        return result
+
+    def _prune_cache(self) -> None:
+        """Remove cached pack results that weren't used for this packing, they are outdated."""
+        for cached_file in CACHE_DIR.glob("*.pickle"):
+            if cached_file not in self._cache_files:
+                try:
+                    cached_file.unlink()
+                except IOError:
+                    pass
 
     def _process_regular_arrays(self) -> None:
         """Add padding after elements of regular arrays."""
@@ -454,6 +557,10 @@ class Packer:
 
     def _process_flash_indexed_arrays(self) -> None:
         """Create index objects for arrays with an index in flash."""
+        # indexes are placed after the last object in flash, including its padding.
+        # the last object in the list may be in internal memory, so it can't be used directly.
+        flash_end = next((obj.address + len(obj.result.data) + obj.pad_after
+                          for obj in reversed(self._objects) if obj.location == Location.FLASH), 0)
         for objects in self._iterate_arrays():
             arr_name = objects[0].group
             arr_type = self._array_types[arr_name]
@@ -463,27 +570,29 @@ class Packer:
                 index = ArrayIndexObject(arr_name, [obj.address for obj in objects])
                 obj = PackObject(f"{arr_name}.index", "", Location.FLASH, index)
                 obj.result = index.pack()
-                obj.address = self._objects[-1].address + len(self._objects[-1].result.data)
+                obj.address = flash_end
+                flash_end += len(obj.result.data)
                 self._objects.append(obj)
+                self._array_indexes[arr_name] = obj
 
     def _print_memory_map(self) -> None:
         """Print a list of result for packed objects by location."""
 
         def do_print(objects: List[PackObject], section: str, show_address: bool) -> None:
-            section_size = sum(len(obj.result.data) for obj in objects)
-            addr_width = max(3, len(f"{section_size:x}")) if show_address else 0
             if not objects:
                 return
+            section_size = sum(len(obj.result.data) for obj in objects)
+            addr_width = max(3, len(f"{section_size:x}")) if show_address else 0
+            addr_spec = f"0{addr_width}x"
+            # multiline results are indented to align with the first line
+            indent = "\n" + " " * (addr_width + 4)
             print(f"{section.upper()} ({readable_size(section_size)})")
             print("=======================")
             for obj in objects:
-                if show_address:
-                    print(f"0x{f'{obj.address:x}'.rjust(addr_width, '0')}: ", end="")
-                name = obj.name
-                if obj.group:
-                    name = f"{obj.group}/" + name
-                res_str = repr(obj.result).replace("\n", "\n" + " " * (addr_width + 4))
-                print(f"{name}, {obj.data.get_type_name()}, {res_str}")
+                addr_str = f"0x{format(obj.address, addr_spec)}: " if show_address else ""
+                name = f"{obj.group}/{obj.name}" if obj.group else obj.name
+                res_str = repr(obj.result).replace("\n", indent)
+                print(f"{addr_str}{name}, {obj.data.get_type_name()}, {res_str}")
             print()
 
         # group objects by location
@@ -495,15 +604,17 @@ class Packer:
         do_print(by_location[Location.FLASH], "flash", True)
 
     def _write_assets_file(self) -> None:
-        """Place objects contiguously and write the result to a file."""
+        """Place objects contiguously and write the result to a file.
+        Objects are streamed to the file, the whole flash image is never built in memory."""
         print("Writing assets file... ", end="")
         try:
-            with open(ASSETS_FILE, "wb") as file:
+            # objects are written one after the other, use a large buffer to reduce writes.
+            with open(ASSETS_FILE, "wb", buffering=1 << 20) as file:
                 for obj in self._objects:
                     if obj.location == Location.FLASH:
                         file.write(obj.result.data)
-                        for i in range(obj.pad_after):
-                            file.write(Packer.PADDING_BYTE)
+                        if obj.pad_after:
+                            file.write(Packer.PADDING_BYTE * obj.pad_after)
             print("DONE")
         except IOError as e:
             self._error(f"could not write assets file: {e}")
@@ -556,12 +667,14 @@ class Packer:
             if first.location == Location.INTERNAL:
                 # Create the array data. All elements are packed within a single array.
                 # Also assign their address within the array data to the objects.
-                data = bytearray()
+                # The array is allocated filled with padding, then elements are copied in place.
+                size = sum(len(obj.result.data) + obj.pad_after for obj in objects)
+                data = bytearray(Packer.PADDING_BYTE * size)
+                addr = 0
                 for obj in objects:
-                    obj.address = len(data)
-                    data += obj.result.data
-                    for i in range(obj.pad_after):
-                        data += Packer.PADDING_BYTE
+                    obj.address = addr
+                    data[addr:addr + len(obj.result.data)] = obj.result.data
+                    addr += len(obj.result.data) + obj.pad_after
                 gen.add_array(f"{name}", 1, data)
 
                 if arr_type == ArrayType.REGULAR:
@@ -571,15 +684,15 @@ class Packer:
 
                 elif arr_type == ArrayType.INDEXED_ABS:
                     # array of absolute positions within the data
-                    addr = [obj.address for obj in objects]
                     gen.add_ptr_array(f"{name}_addr", 1,
                                       [f"&{name_u}[{obj.address}]" for obj in objects])
                     gen.add_macro(f"{name}", ["n"], f"{name_u}_ADDR[n]", location)
 
                 elif arr_type == ArrayType.INDEXED_REL:
                     # address + array of relative offsets within the data
+                    # elements addresses are increasing, so the last offset is the largest.
                     offset = [(obj.address - first.address) for obj in objects]
-                    type_width = uint_width_for_max(max(offset))
+                    type_width = uint_width_for_max(offset[-1])
                     gen.add_array(f"{name}_offset", type_width, offset)
                     gen.add_macro(f"{name}", ["n"], f"{name_u}_ADDR[{name_u}_OFFSET[n]]", location)
 
@@ -599,17 +712,16 @@ class Packer:
 
                 elif arr_type == ArrayType.INDEXED_REL:
                     # address + array of relative offsets within the data
+                    # elements addresses are increasing, so the last offset is the largest.
                     offset = [(obj.address - first.address) for obj in objects]
-                    type_width = uint_width_for_max(max(offset))
+                    type_width = uint_width_for_max(offset[-1])
                     gen.add_define(f"{name}_addr", first.address, is_hex=True)
                     gen.add_array(f"{name}_offset", type_width, offset)
                     gen.add_macro(f"{name}", ["n"], f"{name_u}_ADDR + {name_u}_OFFSET[n]", location)
 
                 elif arr_type == ArrayType.INDEXED_ABS_FLASH:
                     # address of index + bytes per address
-                    index = next((obj for obj in self._objects
-                                  if isinstance(obj.data, ArrayIndexObject) and
-                                  obj.data.array_name == first.group))
+                    index = self._array_indexes[first.group]
                     addr_size = index.result.addr_bytes
                     assert isinstance(index.result, ArrayIndexPackResult)
                     gen.add_define(f"{name}_index", index.address, is_hex=True)
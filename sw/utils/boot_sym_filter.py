@@ -17,6 +17,9 @@ import sys
 
 SYMBOL_TYPES = "bdrt"
 
+# pattern matching a line of nm output: address, symbol type and symbol name
+SYMBOL_LINE_PATTERN = re.compile(r"^([\da-f]+)\s+(\w)\s+(\w+)$")
+
 # symbols matching regexes in the blacklist won't be output,
 # except if they match one of those in the whitelist.
 SYMBOL_BLACKLIST = [
@@ -42,7 +45,7 @@ def main():
     # keep only certain types (functions, variables, etc)
     symbols = {}
     for line in symbols_str.splitlines():
-        match = re.match(r"^([\da-f]+)\s+(\w)\s+(\w+)$", line)
+        match = SYMBOL_LINE_PATTERN.match(line)
         if match:
             symbol_type = match.group(2).lower()
             if symbol_type not in SYMBOL_TYPES:
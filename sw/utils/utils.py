@@ -13,9 +13,10 @@
 #  limitations under the License.
 
 import math
+import struct
 import time
 from pathlib import Path
-from typing import Callable, Union, Any
+from typing import Callable, Union, Any, Sequence
 
 from bitarray import bitarray
 import crcmod
@@ -29,6 +30,9 @@ PathLike = Union[str, Path]
 PROGRESS_BAR_WIDTH = 30
 PROGRESS_BAR_MARGIN = 10
 
+# struct formats for unsigned integers by size in bytes
+UINT_STRUCT_FORMATS = {2: "H", 4: "I"}
+
 
 class DataReader:
     data: bytes
@@ -87,6 +91,18 @@ def readable_size(size: int) -> str:
     raise ValueError()
 
 
+def pack_uints(values: Sequence[int], width: int, byteorder: str) -> bytes:
+    """Serialize unsigned integers all having the same width in bytes,
+    with byte order "big" or "little" (as for `int.to_bytes`)."""
+    if width == 1:
+        return bytes(values)
+    elif width in UINT_STRUCT_FORMATS:
+        # serialize all values at once if there's a struct format for their size.
+        order = ">" if byteorder == "big" else "<"
+        return struct.pack(f"{order}{len(values)}{UINT_STRUCT_FORMATS[width]}", *values)
+    return b"".join(value.to_bytes(width, byteorder) for value in values)
+
+
 def progress_bar(left: str, right: str, progress: float) -> str:
     n = math.floor(progress * PROGRESS_BAR_WIDTH)
     if progress > 0 and n == 0: